@@ -1,9 +1,33 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import warnings
-from typing import List, Tuple, Union, Optional, Dict
+from scipy.linalg import lstsq, qr, solve_triangular
+from scipy.linalg.lapack import get_lapack_funcs
+from typing import Callable, List, Tuple, Union, Optional, Dict
 from utils import eq_system_builder
 
+try:
+    from utils_numba import SOLVE_LOOP_MAX_SPECIES, compute_W_logKs, solve_loop
+
+    _HAS_NUMBA = True
+except ImportError:  # numba is optional, fall back to plain numpy
+    _HAS_NUMBA = False
+
+
+def _clip_total_masses(total_masses: np.ndarray) -> np.ndarray:
+    """
+    Returns total masses as a float array, with zero or negative entries replaced by eps (with a warning)
+    """
+    total_masses = np.array(total_masses, dtype=float)
+    if (total_masses <= 0).any():
+        warnings.warn(
+            "Species concentrations (S) should not be set to zero or negative values, eps has been set instead. The result may not be reliable.",
+            stacklevel=3,
+        )
+        np.maximum(total_masses, 2.2e-16, out=total_masses)
+    return total_masses
+
+
 class EquationSystem:
     def __init__(
         self,
@@ -69,23 +93,111 @@ class ChemicalReaction:
         eq_constants: np.ndarray,
         total_masses: np.ndarray,
     ):
-        total_masses = np.array(total_masses, dtype=float)
-        if min(total_masses) == 0:
-            warnings.warn(
-                "Species concentrations (S) should not be set to zero, eps has been set instead. The result may not be reliable.",
-                stacklevel=2,
-            )
-            I = np.where(total_masses == 0)[0]
-            total_masses[I] = 2.2e-16
+        total_masses = _clip_total_masses(total_masses)
 
+        # contiguous float64 inputs spare LAPACK and numba any conversion or copy at every iteration
         self.species = equation_system.species
-        self.stoichiometry = equation_system.stoichiometry
+        self.stoichiometry = np.ascontiguousarray(equation_system.stoichiometry, dtype=np.float64)
+        self._null_space = None  # block elimination data for square systems, set up below
         self.K = eq_constants
-        self.mass_conservation = equation_system.mass_conservation
+        self.mass_conservation = np.ascontiguousarray(equation_system.mass_conservation, dtype=np.float64)
         self.total_masses = total_masses
         self.result = []
         self.residuals = []
 
+        # work buffers reused by eqsolver, Fortran-ordered so LAPACK can overwrite them in place
+        self._M = np.empty(
+            (
+                np.shape(self.stoichiometry)[0] + np.shape(self.mass_conservation)[0],
+                np.shape(self.stoichiometry)[1],
+            ),
+            order="F",
+        )
+        self._y = np.empty(self._M.shape[0])
+        (self._gesv,) = get_lapack_funcs(("gesv",), (self._M, self._y))
+
+        # overdetermined systems: resolve the least-squares driver and its workspace sizes once
+        self._gelsd = None
+        n_rows, n_cols = self._M.shape
+        if n_rows > n_cols:
+            gelsd, gelsd_lwork = get_lapack_funcs(("gelsd", "gelsd_lwork"), (self._M, self._y))
+            work, iwork, info = gelsd_lwork(n_rows, n_cols, 1)
+            if info == 0:
+                self._gelsd = (gelsd, int(work), int(iwork))
+
+        # square systems: the stoichiometry block of M never changes, so it is factored once here.
+        # Every solution of N x = log(K) reads x_p + Z z, with Z spanning the null space of N, so that
+        # each iteration only has to solve the small (W Z) z = log(Ks) - W x_p system, assembled in preallocated
+        # buffers: (W Z)^T is stored C-ordered so that its transpose can be handed to LAPACK without copies
+        # x_p depends on K and is rebuilt by _update_particular_solution whenever K changes
+        n_reactions, n_species = np.shape(self.stoichiometry)
+        if n_species == n_reactions + np.shape(self.mass_conservation)[0] and n_reactions > 0:
+            Q, R = qr(np.transpose(self.stoichiometry))
+            R = R[:n_reactions]
+            R_diag = np.abs(np.diag(R))
+            if R_diag.min() > n_species * 2.2e-16 * R_diag.max():
+                n_conservations = n_species - n_reactions
+                self._N_range = (np.ascontiguousarray(Q[:, :n_reactions]), R)
+                self._null_space = (
+                    None,
+                    np.ascontiguousarray(Q[:, n_reactions:]),
+                    np.empty((n_conservations, n_conservations)),
+                    np.empty(n_conservations),
+                )
+                self._update_particular_solution()
+
+    def _update_particular_solution(self) -> None:
+        """
+        Rebuilds the particular solution x_p of N x = log(K) used by the block elimination of square systems.
+        Non-finite log(K) values are not checked here, the failure is reported by solve
+        """
+        if self._null_space is not None:
+            Q, R = self._N_range
+            x_p = np.dot(Q, solve_triangular(R, self.logK, trans="T", check_finite=False))
+            self._null_space = (x_p,) + self._null_space[1:]
+
+    # K and total_masses are properties so that their logarithms, constant across iterations and computed
+    # once, are refreshed whenever the user sets new values (e.g. when fitting parameters). They are stored
+    # as read-only private copies: editing them in place would leave the logarithms stale, so it raises instead
+    @property
+    def K(self) -> np.ndarray:
+        return self._K
+
+    @K.setter
+    def K(self, eq_constants: np.ndarray) -> None:
+        self._K = np.array(eq_constants, dtype=np.float64)
+        self._K.flags.writeable = False
+        self.logK = np.log(self._K)
+        self._update_particular_solution()
+
+    @property
+    def total_masses(self) -> np.ndarray:
+        return self._total_masses
+
+    @total_masses.setter
+    def total_masses(self, total_masses: np.ndarray) -> None:
+        self._total_masses = np.array(total_masses, dtype=np.float64)
+        self._total_masses.flags.writeable = False
+        self.logS = np.log(self._total_masses)
+
+    def _step(self, x: np.ndarray, w: float) -> Tuple[np.ndarray, float]:
+        """
+        Single fixed-point step x -> eqsolver(x), returning the updated solution and the norm of the step
+        """
+        return eqsolver(
+            self.stoichiometry,
+            self.logK,
+            self.mass_conservation,
+            self.logS,
+            x,
+            w,
+            self._M,
+            self._y,
+            self._gesv,
+            self._null_space,
+            self._gelsd,
+        )
+
     """
     solve method calls eqsolver to find equilibrium concentration of all species.
     Parameters:
@@ -98,35 +210,169 @@ class ChemicalReaction:
     - w: weighted update for solutions. This can be kept as zero for well-behaving systems. Small values
     such as 0.5 or 1.0 grealy improve code stability for more difficult tasks, but will cause a slower
     approach to convergence.
+    - anderson: number of previous steps mixed by Anderson acceleration, 0 (default) runs the plain iteration.
+    Only useful together with w > 0, where values of 3 to 5 typically cut the number of steps by more than half.
+    The undamped iteration (w = 0) already converges quadratically and anderson > 0 slows it down, e.g. 11 steps
+    with anderson = 3 instead of 6 for the README example. As a safeguard, whenever the fixed-point residual
+    ||F(x) - x|| of the current iterate is larger than that of the previous iterate, the mixing history is
+    dropped and the plain iterate F(x) is taken instead.
     """
 
     def solve(
-        self, iter: int = 1e2, x0 : np.ndarray = None, tolerance: float = 1e2, w: float = 0.0
-    ) -> Tuple[np.ndarray, List[np.ndarray]]:
+        self,
+        iter: int = 1e2,
+        x0: np.ndarray = None,
+        tolerance: float = 1e2,
+        w: float = 0.0,
+        anderson: int = 0,
+    ) -> Tuple[np.ndarray, np.ndarray]:
         iter = int(iter)
-        delta = []
 
-        x0 = (np.ones(np.shape(self.stoichiometry)[1]) if x0 is None else x0)
+        x0 = (np.ones(np.shape(self.stoichiometry)[1]) if x0 is None else np.asarray(x0, dtype=np.float64))
 
-        x, delta_ = eqsolver(self.stoichiometry, self.K, self.mass_conservation, self.total_masses, x0, w)
-        delta.append(delta_)
-
-        for i in range(iter):
-            x, delta_ = eqsolver(self.stoichiometry, self.K, self.mass_conservation, self.total_masses, x, w)
-            delta.append(delta_)
+        if _HAS_NUMBA and anderson == 0 and np.shape(self.stoichiometry)[1] <= SOLVE_LOOP_MAX_SPECIES:
+            # small systems: the whole iteration runs compiled, with no Python dispatch between steps
+            x, delta, converged = solve_loop(
+                self.stoichiometry, self.logK, self.mass_conservation, self.logS, x0, w, iter, tolerance
+            )
+        else:
+            x, delta, converged = self._iterate(x0, iter, tolerance, w, anderson)
 
-            if delta[-1] < tolerance * np.linalg.norm(x * 2.2e-16):
-                self.result = np.exp(x)
-                self.residuals = delta
-                return np.exp(x), delta
+        if not converged:
+            warnings.warn(
+                "Tolerance not reached. Manually check if the result is satisfying. Either change starting point, increase iterations and/or weight.",
+                stacklevel=2,
+            )
 
         self.result = np.exp(x)
         self.residuals = delta
+        return self.result, delta
+
+    def _iterate(
+        self, x0: np.ndarray, iter: int, tolerance: float, w: float, anderson: int
+    ) -> Tuple[np.ndarray, np.ndarray, bool]:
+        """
+        Python implementation of the iteration run by solve, with optional Anderson acceleration.
+        Returns the solution in logarithmic form, the residuals and whether the tolerance was reached
+        """
+        delta = np.empty(iter + 1)
+
+        x, delta[0] = self._step(x0, w)
+        if not np.isfinite(delta[0]):
+            raise np.linalg.LinAlgError("Non-finite step, the linearized system could not be solved")
+
+        # Anderson acceleration history: differences of iterates (dX) and of fixed-point residuals (dG)
+        dX = np.empty((len(x), anderson))
+        dG = np.empty((len(x), anderson))
+        n_stored = 0
+        x_prev, g_prev = x0, x - x0
+
+        for i in range(iter):
+            x_next, delta[i + 1] = self._step(x, w)
+            if not np.isfinite(delta[i + 1]):
+                raise np.linalg.LinAlgError("Non-finite step, the linearized system could not be solved")
+
+            if delta[i + 1] < tolerance * (np.linalg.norm(x_next) * 2.2e-16 + 1e-300):
+                return x_next, delta[: i + 2], True
+
+            if anderson > 0:
+                g = x_next - x
+                if not np.linalg.norm(g) <= np.linalg.norm(g_prev):
+                    # safeguard: the last mixed step did not reduce the residual, restart from the plain iterate
+                    n_stored = 0
+                else:
+                    dX[:, n_stored % anderson] = x - x_prev
+                    dG[:, n_stored % anderson] = g - g_prev
+                    n_stored += 1
+                    dX_ = dX[:, : min(n_stored, anderson)]
+                    dG_ = dG[:, : min(n_stored, anderson)]
+                    A = np.dot(dG_.T, dG_)
+                    A[np.diag_indices_from(A)] += 1e-5 * np.trace(A)
+                    gamma = np.linalg.lstsq(A, np.dot(dG_.T, g), rcond=None)[0]
+                    x_next = x_next - np.dot(dX_ + dG_, gamma)
+                x_prev, g_prev = x, g
+
+            x = x_next
+
+        return x, delta, False
+
+    """
+    solve_batch method solves the same system for a batch of B equilibrium constants and/or total masses at once,
+    for example to compute titration curves or to scan parameters, sharing numpy calls across the whole batch.
+    Parameters:
+    - eq_constants: (B, number of reactions) array of equilibrium constants, by default the ones of the object.
+    - total_masses: (B, number of mass conservations) array of total masses, by default the ones of the object.
+    - iter, x0, tolerance, w: same as solve, x0 can either be shared or given per problem as a (B, n) array.
+    Returns the (B, n) array of equilibrium concentrations and the (B, steps) array of residuals,
+    padded with nan after each problem has converged.
+    As solve, raises numpy.linalg.LinAlgError if any problem of the batch produces a non-finite step
+    (for example a zero equilibrium constant), naming the indices of the offending problems.
+    """
+
+    def solve_batch(
+        self,
+        eq_constants: np.ndarray = None,
+        total_masses: np.ndarray = None,
+        iter: int = 1e2,
+        x0: np.ndarray = None,
+        tolerance: float = 1e2,
+        w: float = 0.0,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        iter = int(iter)
+        n_reactions, n_species = np.shape(self.stoichiometry)
+
+        logK = self.logK if eq_constants is None else np.log(np.asarray(eq_constants, dtype=float))
+        if total_masses is None:
+            logS = self.logS
+        else:
+            logS = np.log(_clip_total_masses(total_masses))
+        logK, logS = np.atleast_2d(logK), np.atleast_2d(logS)
+        B = max(len(logK), len(logS))
+        logK = np.broadcast_to(logK, (B, n_reactions))
+        logS = np.broadcast_to(logS, (B, len(self.mass_conservation)))
+
+        x = np.ones((B, n_species)) if x0 is None else np.array(np.broadcast_to(x0, (B, n_species)), dtype=float)
+        delta = np.full((B, iter + 1), np.nan)
+        active = np.arange(B)
+
+        M = np.empty((B, n_reactions + len(self.mass_conservation), n_species))
+        M[:, :n_reactions] = self.stoichiometry
+        y = np.empty((B, M.shape[1]))
+        y[:, :n_reactions] = logK
+        square = n_species == M.shape[1]
+
+        for i in range(iter + 1):
+            Cx = self.mass_conservation * np.exp(x[active, None, :])
+            Cx_sum = np.sum(Cx, axis=2, keepdims=True)
+            W = Cx / Cx_sum
+            M[active, n_reactions:] = W
+            y[active, n_reactions:] = np.einsum("bij,bj->bi", W, x[active]) - np.log(Cx_sum[..., 0]) + logS[active]
+
+            if square:
+                sol = np.linalg.solve(M[active], y[active, :, None])[..., 0]
+            else:  # solve overdetermined systems as M^(-1) * y
+                sol = np.einsum("bij,bj->bi", np.linalg.pinv(M[active]), y[active])
+
+            dx = sol - x[active]
+            delta_ = np.linalg.norm(dx, axis=1)
+            if not np.isfinite(delta_).all():
+                raise np.linalg.LinAlgError(
+                    f"Non-finite step for problems {active[~np.isfinite(delta_)].tolist()}, the linearized system could not be solved"
+                )
+            delta[active, i] = delta_
+            x[active] += dx if w == 0.0 else dx / (w + 1)
+
+            converged = delta_ < tolerance * (np.linalg.norm(x[active], axis=1) * 2.2e-16 + 1e-300)
+            if i > 0:  # as in solve, the first step never stops the iteration
+                active = active[~converged]
+            if len(active) == 0:
+                return np.exp(x), delta[:, : i + 1]
+
         warnings.warn(
-            "Tolerance not reached. Manually check if the result is satisfying. Either change starting point, increase iterations and/or weight.",
+            f"Tolerance not reached for {len(active)} of {B} problems. Manually check if the result is satisfying. Either change starting point, increase iterations and/or weight.",
             stacklevel=2,
         )
-        return np.exp(x), delta
+        return np.exp(x), delta[:, : iter + 1]
 
     """
     plotter method relies on matplotlib to generate a graph showing algorithm's progress to convergence and final results.
@@ -140,7 +386,7 @@ class ChemicalReaction:
         )
 
         ax1.set_xlabel("steps", fontsize=14, fontname="Arial")
-        ax1.set_ylabel("||r||", fontsize=14, fontname="Arial")
+        ax1.set_ylabel("||dx||", fontsize=14, fontname="Arial")
         ax1.set_title("Algorithm Progress", fontsize=16, fontname="Arial")
         ax1.set_yscale("linear")
 
@@ -157,21 +403,72 @@ class ChemicalReaction:
 
 
 def eqsolver(
-    stoichiometry: np.ndarray, K: np.ndarray, mass_conservation: np.ndarray, total_masses: List[float], x: float, w: float
+    stoichiometry: np.ndarray,
+    logK: np.ndarray,
+    mass_conservation: np.ndarray,
+    logS: np.ndarray,
+    x: float,
+    w: float,
+    M: np.ndarray,
+    y: np.ndarray,
+    gesv: Callable,
+    null_space: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = None,
+    gelsd: Optional[Tuple[Callable, int, int]] = None,
 ) -> Tuple[float, float]:
     """
     eqsolver is the core of equpy and handles the application of Thomas Wayne Wall algorithm on the input
+    - logK, logS: logarithms of equilibrium constants and total masses
+    - M, y: preallocated (Fortran-ordered) buffers for the linearized system, overwritten at every call
+    - gesv: LAPACK gesv handle resolved by ChemicalReaction
+    - null_space: optional (x_p, Z, WZ_T, rhs) tuple used to solve square systems by block elimination, where
+    N (x_p + Z z) = log(K) for any z and WZ_T, rhs are work buffers for the reduced system
+    - gelsd: optional (gelsd, lwork, size_iwork) LAPACK handle and workspace sizes for overdetermined systems
     """
-    Cx = mass_conservation * np.exp(x)
-    W = Cx / np.sum(Cx, axis=1)[:, None]
-    Ks = np.prod((W / mass_conservation) ** W, axis=1) * total_masses
-
-    M = np.vstack((stoichiometry, W))
-    y = np.log(np.hstack((K, Ks)))
-    delta = np.linalg.norm(np.dot(M, x.T) - y[:, None].T)
-
-    if np.shape(stoichiometry)[1] == len(K) + len(total_masses):
-        x = (w * x + np.linalg.solve(M, y)) / (w + 1)
-    else:  # solve overdetermined systems as M^(-1) * y
-        x = (w * x + np.dot(np.linalg.pinv(M), y)) / (w + 1)
+    n_reactions = len(logK)
+    # log(Ks) = sum(W * log(W / C)) + log(S) simplifies to W x - log(sum(C exp(x))) + log(S),
+    # since log(W / C) = x - log(sum(C exp(x))) wherever C > 0 and each row of W sums to 1
+    if _HAS_NUMBA:
+        compute_W_logKs(mass_conservation, x, logS, M[n_reactions:], y[n_reactions:])
+    else:
+        Cx = mass_conservation * np.exp(x)
+        Cx_sum = np.sum(Cx, axis=1)
+        W = np.divide(Cx, Cx_sum[:, None], out=M[n_reactions:])
+        np.dot(W, x, out=y[n_reactions:])
+        y[n_reactions:] += logS - np.log(Cx_sum)
+
+    sol = None
+    if null_space is not None:
+        x_p, Z, WZ_T, rhs = null_space
+        W = M[n_reactions:]
+        np.dot(Z.T, W.T, out=WZ_T)
+        np.dot(W, x_p, out=rhs)
+        np.subtract(y[n_reactions:], rhs, out=rhs)
+        _, _, z, info = gesv(WZ_T.T, rhs, overwrite_a=1, overwrite_b=1)
+        if info == 0:  # otherwise the reduced system is singular, retry on the full one
+            sol = x_p + np.dot(Z, z)
+
+    if sol is None:
+        # the LAPACK calls overwrite M and y, so the constant blocks are restored at every call
+        np.copyto(M[:n_reactions], stoichiometry)
+        np.copyto(y[:n_reactions], logK)
+
+    if sol is None and np.shape(stoichiometry)[1] == len(logK) + len(logS):
+        _, _, sol, info = gesv(M, y, overwrite_a=1, overwrite_b=1)
+        if info > 0:
+            raise np.linalg.LinAlgError("Singular matrix")
+    elif sol is None and gelsd is not None:  # solve overdetermined systems in the least-squares sense
+        gelsd_, lwork, size_iwork = gelsd
+        sol, _, _, info = gelsd_(M, y[:, None], lwork, size_iwork, overwrite_a=1, overwrite_b=1)
+        if info > 0:
+            raise np.linalg.LinAlgError("SVD did not converge in Linear Least Squares")
+        sol = sol[: np.shape(stoichiometry)[1], 0]
+    elif sol is None:
+        sol = lstsq(M, y, lapack_driver="gelsd", overwrite_a=True, overwrite_b=True, check_finite=False)[0]
+
+    # the norm of the full step measures how far x is from the solution, at no extra cost
+    dx = np.subtract(sol, x, out=sol)
+    delta = np.linalg.norm(dx)
+    if w != 0.0:  # the common unweighted case takes the full step
+        dx /= w + 1
+    x = x + dx
     return x, delta
@@ -1,30 +1,69 @@
-import re, csv
+import re
 import numpy as np
 from math import floor, log10
 from typing import List, Set, Dict, Tuple
 
 
-def define_species_set(eq: List[str]) -> Set[str]:
+# tokens of the joined equations: a separator, or an optional coefficient followed by a species name.
+# Any other non-whitespace character is captured by the last group and reported as malformed input
+_REACTION_TOKEN_RE = re.compile(r"([+=;])|(\d*)\s*([^\d\s+=;][^\s+=;]*)|(\S)")
+_CONSERVATION_TOKEN_RE = re.compile(r"([+;])|(\d*\.?\d*)\s*([^\d\s+=;.][^\s+=;]*)|(\S)")
+
+
+def check_equations(eq: List[str], kind: str) -> None:
     """
-    Extract species involved in the reaction from symbolic equations
+    Rejects empty equations and equations containing ';', which is used internally to separate equations
     Parameters:
     - eq: list of equations in symbolic form
+    - kind: description of the equations used in error messages, e.g. "reaction"
     """
-    e_ = " ".join(eq)
-    e_ = e_.split(" ")
+    for eq_ in eq:
+        if not eq_.strip():
+            raise ValueError(f"Empty {kind} in {eq}")
+        if ";" in eq_:
+            raise ValueError(f"Unexpected ';' in {kind} '{eq_}'")
 
-    species_set = []
 
-    for l in e_:
-        if l != "+" and l != "=":
-            species_set.append(l)
+def tokenize_reactions(eq: List[str]) -> Tuple[List[int], List[str], List[int]]:
+    """
+    Scans all symbolic reactions in a single pass, returning for each species occurrence its reaction index,
+    name and signed stoichiometric coefficient (negative for reactants, positive for products)
+    Parameters:
+    - eq: list of equations in symbolic form
+    """
+    check_equations(eq, "reaction")
+    rows, names, coefficients = [], [], []
+    row, sign = 0, -1
+
+    for separator, coefficient, name, unexpected in _REACTION_TOKEN_RE.findall(";".join(eq)):
+        if unexpected:
+            raise ValueError(f"Unexpected '{unexpected}' in reaction '{eq[row]}'")
+        elif separator == ";":
+            if sign != 1:
+                raise ValueError(f"Reaction '{eq[row]}' must contain exactly one '='")
+            row, sign = row + 1, -1
+        elif separator == "=":
+            if sign == 1:
+                raise ValueError(f"Reaction '{eq[row]}' must contain exactly one '='")
+            sign = 1
+        elif name:
+            rows.append(row)
+            names.append(name)
+            coefficients.append(sign * int(coefficient or 1))
+
+    if eq and sign != 1:
+        raise ValueError(f"Reaction '{eq[row]}' must contain exactly one '='")
+
+    return rows, names, coefficients
 
-    for i, entry in enumerate(species_set):
-        if entry[0].isdigit():
-            entry_split = re.findall("\d+|\D+", entry)
-            species_set[i] = "".join(entry_split[1:])
 
-    return set(species_set)
+def define_species_set(eq: List[str]) -> Set[str]:
+    """
+    Extract species involved in the reaction from symbolic equations
+    Parameters:
+    - eq: list of equations in symbolic form
+    """
+    return set(tokenize_reactions(eq)[1])
 
 
 def define_reactions(eq: List[str]) -> Tuple[np.ndarray, int, Dict[str, int]]:
@@ -34,38 +73,13 @@ def define_reactions(eq: List[str]) -> Tuple[np.ndarray, int, Dict[str, int]]:
     - eq: list of equations in symbolic form
     """
 
-    species_set = define_species_set(eq)
+    rows, names, coefficients = tokenize_reactions(eq)
+    species_set = set(names)
     n = len(species_set)
     species = {string: index for index, string in enumerate(sorted(species_set))}
 
     N = np.zeros((len(eq), n))
-
-    for i, eq_ in enumerate(eq):
-        eq_ = eq_.split("=")
-        eq_left = eq_[0].split("+")
-
-        for element in eq_left:
-            element = element.strip()
-            element_ = re.findall("\d+|\D+", element)  # obtain blocks for every species
-
-            if len(element_) == 1:
-                N[i, species[element_[0]]] = -1
-            elif len(element_) > 1 and element_[0].isalpha():
-                N[i, species["".join(element_)]] = -1
-            else:
-                N[i, species["".join(element_[1:])]] = -int(element_[0])
-
-        eq_right = eq_[1].split("+")
-        for element in eq_right:
-            element = element.strip()
-            element_ = re.findall("\d+|\D+", element)  # obtain blocks for every species
-
-            if len(element_) == 1:
-                N[i, species[element_[0]]] = 1
-            elif len(element_) > 1 and element_[0].isalpha():
-                N[i, species["".join(element_)]] = 1
-            else:
-                N[i, species["".join(element_[1:])]] = element_[0]
+    np.add.at(N, (rows, [species[name] for name in names]), coefficients)
 
     return N, n, species
 
@@ -79,20 +93,22 @@ def define_conservations(eq: List[str], n: int, species: Dict[str, int]) -> np.n
     - species: dictionary containing {name: index} of the species involved in the reactions
     """
 
-    pattern = r"(\d*\.?\d*)?([A-Za-z\d]+)"
-    M = np.zeros((len(eq), n))
-    eq = [eq_.replace("*", "") for eq_ in eq]
+    check_equations(eq, "mass conservation")
+    rows, cols, coefficients = [], [], []
+    row = 0
 
-    for i, eq_ in enumerate(eq):
-        eq_ = eq_.split("+")
+    for separator, coefficient, name, unexpected in _CONSERVATION_TOKEN_RE.findall(";".join(eq).replace("*", "")):
+        if unexpected:
+            raise ValueError(f"Unexpected '{unexpected}' in mass conservation '{eq[row]}'")
+        elif separator == ";":
+            row += 1
+        elif name:
+            rows.append(row)
+            cols.append(species[name])
+            coefficients.append(float(coefficient or 1))
 
-        for element_ in eq_:
-            element_ = re.findall(pattern, element_)
-            element_ = [elem for elem in element_[0]]
-            if len(element_[0]) == 0:
-                M[i, species[element_[1]]] = 1
-            else:
-                M[i, species[element_[1]]] = element_[0]
+    M = np.zeros((len(eq), n))
+    np.add.at(M, (rows, cols), coefficients)
 
     return M
 
@@ -120,30 +136,8 @@ def csv_loader(
     Assembles matrices suitable for the solver starting from .csv files
     """
 
-    N = []
-    K = []
-    C = []
-    S = []
-
-    with open(filename_N, newline="", encoding="utf-8-sig") as csvfile:
-        filecontent = csv.reader(csvfile, delimiter=" ", quotechar="|")
-        for i, row in enumerate(filecontent):
-            if i == 0:
-                lbls = row[0].split(",")[0:-1]
-            else:
-                N.append(row[0].split(",")[0:-1])
-                K.append(row[0].split(",")[-1])
-
-    with open(filename_C, newline="", encoding="utf-8-sig") as csvfile:
-        filecontent = csv.reader(csvfile, delimiter=" ", quotechar="|")
-        for i, row in enumerate(filecontent):
-            if i > 0:
-                C.append(row[0].split(",")[0:-1])
-                S.append(row[0].split(",")[-1])
-
-    N = np.array(N, dtype="float")
-    K = np.array(K, dtype="float")
-    C = np.array(C, dtype="float")
-    S = np.array(S, dtype="float")
-
-    return N, K, C, S
+    # the header row holds the species labels, the last column K (or S)
+    NK = np.loadtxt(filename_N, delimiter=",", skiprows=1, encoding="utf-8-sig", ndmin=2)
+    CS = np.loadtxt(filename_C, delimiter=",", skiprows=1, encoding="utf-8-sig", ndmin=2)
+
+    return NK[:, :-1], NK[:, -1], CS[:, :-1], CS[:, -1]
@@ -0,0 +1,124 @@
+import numpy as np
+from typing import Tuple
+from math import exp, log
+from numba import njit, prange
+
+# below this number of mass conservations, spinning up threads costs more than the row work they share
+PARALLEL_MIN_ROWS = 32
+# up to this number of species, solve runs its whole iteration in solve_loop
+SOLVE_LOOP_MAX_SPECIES = 20
+# fastmath flags without the no-nan/no-inf assumptions, so that non-finite iterates can still be detected
+_FASTMATH = {"nsz", "arcp", "contract", "afn", "reassoc"}
+
+
+@njit(fastmath=_FASTMATH, cache=True, error_model="numpy")
+def _W_logKs_row(
+    i: int, C: np.ndarray, x: np.ndarray, logS: np.ndarray, W_out: np.ndarray, logKs_out: np.ndarray
+) -> None:
+    """
+    Computes row i of W and log(Ks), see compute_W_logKs
+    """
+    n = C.shape[1]
+    s = 0.0
+    for j in range(n):
+        Cx = C[i, j] * exp(x[j])
+        W_out[i, j] = Cx
+        s += Cx
+
+    # sum(W * log(W / C)) over the row reduces to W x - log(s), one log per row
+    acc = 0.0
+    for j in range(n):
+        W = W_out[i, j] / s
+        W_out[i, j] = W
+        acc += W * x[j]
+    logKs_out[i] = acc - log(s) + logS[i]
+
+
+@njit(fastmath=_FASTMATH, cache=True, error_model="numpy")
+def _compute_W_logKs_serial(
+    C: np.ndarray, x: np.ndarray, logS: np.ndarray, W_out: np.ndarray, logKs_out: np.ndarray
+) -> None:
+    for i in range(C.shape[0]):
+        _W_logKs_row(i, C, x, logS, W_out, logKs_out)
+
+
+@njit(parallel=True, fastmath=_FASTMATH, cache=True, error_model="numpy")
+def _compute_W_logKs_parallel(
+    C: np.ndarray, x: np.ndarray, logS: np.ndarray, W_out: np.ndarray, logKs_out: np.ndarray
+) -> None:
+    for i in prange(C.shape[0]):
+        _W_logKs_row(i, C, x, logS, W_out, logKs_out)
+
+
+def compute_W_logKs(
+    C: np.ndarray, x: np.ndarray, logS: np.ndarray, W_out: np.ndarray, logKs_out: np.ndarray
+) -> None:
+    """
+    Fused computation of the weights W and of log(Ks) used by eqsolver, filling W_out and logKs_out in place.
+    Rows are independent and are spread over threads for large systems.
+    Parameters:
+    - C: mass conservation matrix
+    - x: current solution in logarithmic form
+    - logS: logarithm of the total masses
+    - W_out: output buffer with the same shape as C
+    - logKs_out: output buffer with one entry per mass conservation
+    """
+    if C.shape[0] < PARALLEL_MIN_ROWS:
+        _compute_W_logKs_serial(C, x, logS, W_out, logKs_out)
+    else:
+        _compute_W_logKs_parallel(C, x, logS, W_out, logKs_out)
+
+
+@njit(fastmath=_FASTMATH, cache=True, error_model="numpy")
+def solve_loop(
+    N: np.ndarray,
+    logK: np.ndarray,
+    C: np.ndarray,
+    logS: np.ndarray,
+    x0: np.ndarray,
+    w: float,
+    max_iter: int,
+    tolerance: float,
+) -> Tuple[np.ndarray, np.ndarray, bool]:
+    """
+    Compiled version of the whole iteration run by ChemicalReaction.solve, same convergence criterion.
+    Returns the solution in logarithmic form, the residuals and whether the tolerance was reached
+    Parameters:
+    - N: stoichiometry matrix
+    - logK: logarithm of the equilibrium constants
+    - C: mass conservation matrix
+    - logS: logarithm of the total masses
+    - x0: initial guess in logarithmic form
+    - w, max_iter, tolerance: weight, maximum number of iterations and tolerance as in ChemicalReaction.solve
+    """
+    n_reactions, n = N.shape
+    M = np.empty((n_reactions + C.shape[0], n))
+    y = np.empty(n_reactions + C.shape[0])
+    M[:n_reactions] = N
+    y[:n_reactions] = logK
+    W = M[n_reactions:]
+    logKs = y[n_reactions:]
+
+    x = x0.copy()
+    residuals = np.empty(max_iter + 1)
+    for i in range(max_iter + 1):
+        for r in range(C.shape[0]):
+            _W_logKs_row(r, C, x, logS, W, logKs)
+
+        if M.shape[0] == n:
+            sol = np.linalg.solve(M, y)
+        else:  # solve overdetermined systems in the least-squares sense
+            sol = np.linalg.lstsq(M, y)[0]
+
+        dx = sol - x
+        residuals[i] = np.linalg.norm(dx)
+        if not np.isfinite(residuals[i]):
+            raise np.linalg.LinAlgError("Non-finite step, the linearized system could not be solved")
+        if w != 0.0:
+            dx /= w + 1
+        x += dx
+
+        if i > 0 and residuals[i] < tolerance * (np.linalg.norm(x) * 2.2e-16 + 1e-300):
+            return x, residuals[: i + 1], True
+
+    return x, residuals, False